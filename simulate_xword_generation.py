@@ -1,22 +1,80 @@
 """Simulate all keyboard commands required to generate crosswords using
-クロスワード　ギバー. This allows us to create roughly 4 crossword puzzles per
-minute automatically.
+クロスワード　ギバー. Each fill attempt plus save takes roughly 25-45 seconds
+depending on the retry budget used, so this creates roughly 2 crossword
+puzzles per minute automatically when the first attempt succeeds. A puzzle
+that needs every retry budget takes roughly 105 seconds before it is given up
+on.
 
 The destination folder must be manually set in クロスワード　ギバー before
-running this module.
+running this module, and LEVEL/OUTPUT_DIR below must be set to match it.
+Puzzles already saved in OUTPUT_DIR are skipped, so this module can be rerun
+to fill in puzzles that timed out.
+
+Fill times are heavy-tailed: one series of restarts may need minutes while
+another finishes in seconds. Since クロスワード　ギバー is a single GUI window
+driven by keystrokes, fill attempts cannot be raced in parallel. Instead, each
+puzzle works through a portfolio of retry budgets one after another, stopping
+at the first one whose puzzle file actually gets saved. First attempts and
+fallback attempts for each budget are recorded per level in STATS_FILE, and
+the budget with the best first-attempt throughput is used first.
 """
 
 
+import json
+import os
 import time
 
 from pynput.keyboard import Controller, Key
 
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LEVEL = 4
+OUTPUT_DIR = os.path.join(BASE_DIR, 'data', str(LEVEL))
+STATS_FILE = os.path.join(BASE_DIR, 'data', 'fill_strategy_stats.json')
+N_PUZZLES = 100
+
+# Every EXPLORE_EVERY-th puzzle starts with the next budget in turn instead
+# of the best one, so every budget keeps collecting first-attempt stats.
+EXPLORE_EVERY = 5
+
+# This many puzzles in a row producing no file means OUTPUT_DIR most likely
+# does not match the folder set in クロスワード　ギバー.
+MAX_CONSECUTIVE_FAILURES = 3
+
+# Rough time taken by the generate dialog and the save keystrokes.
+ATTEMPT_OVERHEAD = 7
+
+# When a fill times out, クロスワード　ギバー shows a retry dialog, and 'r' is
+# its Retry (再試行(R)) accelerator, which restarts the fill. Holding 'r'
+# auto-repeats it, so every retry dialog that appears while it is held is
+# answered immediately; repeats that land on no dialog do nothing. The script
+# cannot change how long each fill runs, only how long it keeps retrying
+# before pressing Enter and saving. So these are retry budgets: a longer
+# budget lets the app run more of its own timeout-and-retry cycles, which
+# succeeds on more hard puzzles but costs more time per puzzle. Which budget
+# gives the best throughput depends on the level, which is what the stats
+# decide. Each budget is (first 'r' press, second 'r' press, release of 'r'),
+# in seconds after the fill is started.
+FILL_STRATEGIES = {
+    'baseline_budget': (3, 6, 16),  # Original keystrokes
+    'extended_budget': (3, 6, 28),
+    'long_budget': (3, 6, 40),
+}
+
+
 keyboard = Controller()
 
-time.sleep(5)
 
-for i in range(1, 101):  # Filename will be i.xwj
+def tap(key, delay=0.1):
+    keyboard.press(key)
+    time.sleep(delay)
+    keyboard.release(key)
+    time.sleep(delay)
+
+
+def fill_puzzle(strategy):
+    first_press, second_press, release = FILL_STRATEGIES[strategy]
     keyboard.press(Key.ctrl_l)
     time.sleep(0.1)
     keyboard.press('g')
@@ -24,20 +82,19 @@ for i in range(1, 101):  # Filename will be i.xwj
     keyboard.release(Key.ctrl_l)
     keyboard.release('g')
     time.sleep(0.1)
-    keyboard.press(Key.enter)
-    time.sleep(0.1)
-    keyboard.release(Key.enter)
-    time.sleep(3)
+    tap(Key.enter)
+    time.sleep(first_press)
     keyboard.press('r')
-    time.sleep(3)
+    time.sleep(second_press - first_press)
     keyboard.press('r')
-    time.sleep(10)
+    time.sleep(release - second_press)
     keyboard.release('r')
     time.sleep(0.1)
-    keyboard.press(Key.enter)
-    time.sleep(0.1)
-    keyboard.release(Key.enter)
-    time.sleep(0.5)
+    tap(Key.enter)
+    time.sleep(0.4)
+
+
+def save_puzzle(i):
     keyboard.press(Key.ctrl_l)
     time.sleep(0.1)
     keyboard.press('s')
@@ -46,31 +103,116 @@ for i in range(1, 101):  # Filename will be i.xwj
     keyboard.release('s')
     time.sleep(1)
     for char in str(i):
-        keyboard.press(char)
-        time.sleep(0.1)
-        keyboard.release(char)
-        time.sleep(0.1)
-    keyboard.press(Key.tab)
-    time.sleep(0.1)
-    keyboard.release(Key.tab)
-    time.sleep(0.1)
+        tap(char)
+    tap(Key.tab)
     keyboard.press(Key.down)
     time.sleep(0.1)
-    keyboard.press(Key.down)
-    time.sleep(0.1)
-    keyboard.release(Key.down)
-    time.sleep(0.1)
-    keyboard.press(Key.enter)
-    time.sleep(0.1)
-    keyboard.release(Key.enter)
-    time.sleep(1)
-    keyboard.press(Key.tab)
-    time.sleep(0.1)
+    tap(Key.down)
+    tap(Key.enter)
+    time.sleep(0.9)
     keyboard.press(Key.tab)
     time.sleep(0.1)
-    keyboard.release(Key.tab)
-    time.sleep(0.1)
-    keyboard.press(Key.enter)
-    time.sleep(0.1)
-    keyboard.release(Key.enter)
-    time.sleep(1)
+    tap(Key.tab)
+    tap(Key.enter)
+    time.sleep(0.9)
+
+
+def load_stats():
+    if not os.path.exists(STATS_FILE):
+        return {}
+    with open(STATS_FILE, 'r', encoding='utf-8') as infile:
+        return json.load(infile)
+
+
+def save_stats(stats):
+    with open(STATS_FILE, 'w', encoding='utf-8') as outfile:
+        json.dump(stats, outfile, indent=4)
+
+
+def first_attempt_throughput(level_stats, strategy):
+    """Puzzles per second when a strategy is tried first. Fallback attempts
+    are left out since they only see puzzles another strategy failed on.
+    Untried strategies rank first so they get tried."""
+    strategy_stats = level_stats['strategies'][strategy]
+    if not strategy_stats['first_attempts']:
+        return float('inf')
+    attempt_time = FILL_STRATEGIES[strategy][-1] + ATTEMPT_OVERHEAD
+    return (strategy_stats['first_wins']
+            / (strategy_stats['first_attempts'] * attempt_time))
+
+
+def order_strategies(level_stats, i):
+    """Best strategy first, except on every EXPLORE_EVERY-th puzzle, where
+    the strategies take turns going first."""
+    ranked = sorted(FILL_STRATEGIES,
+                    key=lambda s: -first_attempt_throughput(level_stats, s))
+    if i % EXPLORE_EVERY == 0:
+        first = list(FILL_STRATEGIES)[
+            (i // EXPLORE_EVERY) % len(FILL_STRATEGIES)]
+        ranked.remove(first)
+        ranked.insert(0, first)
+    return ranked
+
+
+def record_attempts(level_stats, attempts, won):
+    for n, strategy in enumerate(attempts):
+        prefix = 'first' if n == 0 else 'fallback'
+        strategy_stats = level_stats['strategies'][strategy]
+        strategy_stats[f'{prefix}_attempts'] += 1
+        if won and n == len(attempts) - 1:
+            strategy_stats[f'{prefix}_wins'] += 1
+    if not won:
+        level_stats['failed'] += 1
+
+
+if not os.path.isdir(OUTPUT_DIR):
+    raise FileNotFoundError(f'Output directory {OUTPUT_DIR} does not exist')
+
+stats = load_stats()
+level_stats = stats.setdefault(str(LEVEL), {'strategies': {}, 'failed': 0})
+for strategy in FILL_STRATEGIES:
+    level_stats['strategies'].setdefault(strategy, {
+        'first_attempts': 0,
+        'first_wins': 0,
+        'fallback_attempts': 0,
+        'fallback_wins': 0,
+    })
+
+time.sleep(5)
+
+# Failed puzzles are only recorded once a later puzzle gets saved, so a
+# wrong OUTPUT_DIR never makes it into the stats.
+pending_failures = []
+for i in range(1, N_PUZZLES + 1):  # Filename will be i.xwj
+    outfile_path = os.path.join(OUTPUT_DIR, f'{i}.xwj')
+    if os.path.exists(outfile_path):
+        print(f'Puzzle {i} already exists, skipping')
+        continue
+    attempts = []
+    for strategy in order_strategies(level_stats, i):
+        fill_puzzle(strategy)
+        save_puzzle(i)
+        attempts.append(strategy)
+        if os.path.exists(outfile_path):
+            print(f'Puzzle {i} filled using {strategy} strategy')
+            break
+    else:
+        print(f'Puzzle {i} timed out with all strategies')
+        pending_failures.append(attempts)
+        if len(pending_failures) == MAX_CONSECUTIVE_FAILURES:
+            raise RuntimeError(f'{MAX_CONSECUTIVE_FAILURES} puzzles in a row '
+                               f'were not saved to {OUTPUT_DIR}. Check that '
+                               'OUTPUT_DIR matches the folder set in '
+                               'クロスワード　ギバー.')
+        continue
+    for failed_attempts in pending_failures:
+        record_attempts(level_stats, failed_attempts, won=False)
+    pending_failures = []
+    record_attempts(level_stats, attempts, won=True)
+    save_stats(stats)
+
+for failed_attempts in pending_failures:
+    record_attempts(level_stats, failed_attempts, won=False)
+save_stats(stats)
+
+print(f'Level {LEVEL} fill strategy stats: {level_stats}')